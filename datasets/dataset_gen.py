@@ -158,6 +158,11 @@ if __name__ == '__main__':
     print "Writing datasets to qri.pkl.gz..."
     with gzip.open("qri.pkl.gz", "wb") as file:
         file.write(cPickle.dumps(datasets))
+    print "Writing datasets to qri.npz..."
+    train_set, valid_set, test_set = datasets
+    np.savez("qri.npz", train_x=train_set[0], train_y=train_set[1],
+             valid_x=valid_set[0], valid_y=valid_set[1],
+             test_x=test_set[0], test_y=test_set[1])
     print "Done!"
     print "Plotting chunks..."
     plot_chunks(datasets)
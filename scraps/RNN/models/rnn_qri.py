@@ -374,6 +374,11 @@ class MetaRNN(BaseEstimator):
         logger.info('... training')
         epoch = 0
 
+        # preallocate buffers for the per-sequence losses
+        train_losses = np.empty(n_train, dtype=config.floatX)
+        if self.interactive:
+            test_losses = np.empty(n_test, dtype=config.floatX)
+
         while (epoch < self.n_epochs):
             epoch = epoch + 1
             for idx in xrange(n_train):
@@ -389,14 +394,14 @@ class MetaRNN(BaseEstimator):
 
                 if iter % validation_frequency == 0:
                     # compute loss on training set
-                    train_losses = [compute_train_error(i)
-                                    for i in xrange(n_train)]
-                    this_train_loss = np.mean(train_losses)
+                    for i in xrange(n_train):
+                        train_losses[i] = compute_train_error(i)
+                    this_train_loss = train_losses.mean()
 
                     if self.interactive:
-                        test_losses = [compute_test_error(i)
-                                        for i in xrange(n_test)]
-                        this_test_loss = np.mean(test_losses)
+                        for i in xrange(n_test):
+                            test_losses[i] = compute_test_error(i)
+                        this_test_loss = test_losses.mean()
 
                         logger.info('epoch %i, seq %i/%i, tr loss %f '
                                     'te loss %f lr: %f' % \
@@ -6,7 +6,7 @@ import theano
 import theano.tensor as T
 from theano.tensor.signal import downsample
 from theano.tensor.nnet import conv
-from nnet_functions import relu, abs_error_cost
+from nnet_fns import relu, abs_error_cost
 
 
 # Configure floating points for Theano
@@ -55,8 +55,11 @@ class ConvPoolLayer(Layer):
         self.W = Layer.shared_uniform(rng, self.filter_shape, W_bound)
         self.b = Layer.shared_zeros(filters)
 
-        # Convolve input feature maps with filters
-        conv_out = conv.conv2d(self.input, self.W, None, self.filter_shape)
+        # Convolve input feature maps with filters, specializing on all known
+        # shapes (the batch size is left free)
+        image_shape = (None, input_number, 1, input_length)
+        conv_out = conv.conv2d(self.input, self.W, image_shape,
+                               self.filter_shape)
 
         # Downsample each feature map individually, using maxpooling
         pooled_out = downsample.max_pool_2d(input=conv_out, ds=(1, poolsize))
@@ -157,14 +160,17 @@ class RecurrentLayer(FullyConnectedLayer):
         # Store params of this layer
         self.params = [self.W, self.W_r, self.b]
         
+        # Project all inputs at once with a single matrix product
+        input_proj = T.dot(self.input, self.W) + self.b
+        
         # Recurrent step function
-        def step(x):
-            self.h = T.dot(self.h, self.W_r) + T.dot(x, self.W) + self.b
+        def step(x_proj):
+            self.h = T.dot(self.h, self.W_r) + x_proj
             self.h = self.activ_fn(self.h)
             return self.h
         
         # Compute hidden layer as output
-        self.output, _ = theano.scan(step, self.input)
+        self.output, _ = theano.scan(step, input_proj)
     
     def __repr__(self):
         """Return string representation of RecurrentLayer"""
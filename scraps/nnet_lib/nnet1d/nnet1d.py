@@ -5,11 +5,15 @@ import copy
 import cPickle
 import gzip
 import matplotlib.pyplot as plt
+import multiprocessing
 import numpy as np
 import theano
 import theano.tensor as T
 import time
 import warnings
+from collections import OrderedDict
+from multiprocessing.sharedctypes import RawArray
+import nnet_fast
 from layers1d import ConvPoolLayer, FullyConnectedLayer, RecurrentLayer, Layer
 from nnet_fns import abs_error_cost, relu
 
@@ -20,19 +24,41 @@ warnings.simplefilter("ignore")
 
 # Configure floating point numbers for Theano
 theano.config.floatX = "float32"
+
+
+# Time cuDNN convolution algorithms once per shape and reuse the fastest,
+# unless they were configured through THEANO_FLAGS or .theanorc
+for algo in ("algo_fwd", "algo_bwd_data", "algo_bwd_filter"):
+    try:
+        theano.configparser.fetch_val_for_key("dnn.conv." + algo)
+    except KeyError:
+        setattr(theano.config.dnn.conv, algo, "time_once")
+
+
+def output_mode():
+    """Return the mode for compiling output functions: the configured mode,
+    but keeping intermediate buffers alive between calls when that mode is
+    the default C virtual machine"""
+    if theano.config.mode == "Mode" and theano.config.linker == "cvm":
+        return theano.Mode(linker="cvm_nogc",
+                           optimizer=theano.config.optimizer)
+    return theano.compile.get_default_mode()
     
 
 class NNet1D(object):
     """A neural network implemented for 1D neural networks in Theano"""
     def __init__(self, seed, datafile, batch_size, learning_rate, momentum,
-                 cost_fn=abs_error_cost):
+                 cost_fn=abs_error_cost, data_dtype=theano.config.floatX):
         """Initialize network: seed the random number generator, load the
-        datasets, and store model parameters"""
-        # Store random number generator, batch size, learning rate and momentum
+        datasets (stored as data_dtype, e.g. float16 to halve their memory on
+        the host), and store model parameters"""
+        # Store random number generator and batch size
         self.rng = np.random.RandomState(seed)
         self.batch_size = batch_size
-        self.learning_rate = learning_rate
-        self.momentum = momentum
+        
+        # Learning rate and momentum are shared to change without recompiling
+        self.learning_rate = theano.shared(np.float32(learning_rate))
+        self.momentum = theano.shared(np.float32(momentum))
         
         # Store cost function
         self.cost_fn = cost_fn
@@ -45,7 +71,7 @@ class NNet1D(object):
         self.y = T.matrix('y', theano.config.floatX)
         
         # Split into training, validation, and testing datasets
-        datasets = NNet1D.load_data(datafile)
+        datasets = NNet1D.load_data(datafile, data_dtype)
         self.train_set_x, self.train_set_y = datasets[0]
         self.valid_set_x, self.valid_set_y = datasets[1]
         self.test_set_x, self.test_set_y = datasets[2]
@@ -170,21 +196,51 @@ class NNet1D(object):
         self.train_errors = []
         self.valid_errors = []
         
+        # Datasets are stored as data_dtype but computed on as floatX
+        floatX = theano.config.floatX
+        train_x = T.cast(self.train_set_x, floatX)
+        train_y = T.cast(self.train_set_y, floatX)
+        
+        # Order of training samples, shuffled by train() every epoch
+        n_train = self.train_set_x.get_value(borrow=True).shape[0]
+        self.idx = theano.shared(np.arange(n_train, dtype="int32"))
+        
         # Index for batching
         i = T.lscalar()
         
-        # Batching for training set
+        # Batching for training set, taking samples in shuffled order
         batch_size = self.batch_size
-        givens = {self.x: self.train_set_x[i*batch_size:(i+1)*batch_size],
-                  self.y: self.train_set_y[i*batch_size:(i+1)*batch_size]}
+        def batch_givens(k):
+            """Return the givens for the k-th batch of the training set"""
+            rows = self.idx[k*batch_size:(k+1)*batch_size]
+            return {self.x: T.cast(self.train_set_x[rows], floatX),
+                    self.y: T.cast(self.train_set_y[rows], floatX)}
+        givens = batch_givens(i)
         
         # Stochastic gradient descent algorithm for training function
         params = [param for layer in self.layers for param in layer.params]
-        updates = self.gradient_updates_momentum(params)
+        
+        # Momentum velocity of all parameters as one flat vector, shared
+        # between training functions
+        size = sum(param.get_value(borrow=True).size for param in params)
+        self.param_update = Layer.shared_zeros(size)
+        updates = self.gradient_updates_momentum(params, self.param_update)
         
         # Make Theano training function
         self.train_batch = theano.function([i], updates=updates, givens=givens)
         
+        # Training step over a single batch for use within scan
+        def step(k):
+            cost = theano.clone(self.cost, replace=batch_givens(k))
+            updates = self.gradient_updates_momentum(params,
+                                                     self.param_update, cost)
+            return cost, OrderedDict(updates)
+
+        # Loop over all batches in one Theano function, returning mean cost
+        costs, updates = theano.scan(step,
+                                     sequences=T.arange(self.n_train_batches))
+        self.train_epoch = theano.function([], T.mean(costs), updates=updates)
+        
         # Shared variables for output and error functions
         x = T.matrix()
         y = T.matrix()
@@ -192,49 +248,101 @@ class NNet1D(object):
         
         # Make Theano output and error functions
         givens = {self.x: x}
-        self.output = theano.function([x], output, givens=givens)
+        self.output = theano.function([x], output, givens=givens,
+                                      mode=output_mode(),
+                                      allow_input_downcast=True,
+                                      on_unused_input="ignore")
         givens = {self.x: x, self.y: y}
         self.error = theano.function([x, y], self.cost, givens=givens)
-        givens = {self.x: self.train_set_x, self.y: self.train_set_y}
+        givens = {self.x: train_x, self.y: train_y}
         self.train_error = theano.function([], self.cost, givens=givens)
-        givens = {self.x: self.valid_set_x, self.y: self.valid_set_y}
+        givens = {self.x: T.cast(self.valid_set_x, floatX),
+                  self.y: T.cast(self.valid_set_y, floatX)}
         self.valid_error = theano.function([], self.cost, givens=givens)
-        givens = {self.x: self.test_set_x, self.y: self.test_set_y}
+        givens = {self.x: T.cast(self.test_set_x, floatX),
+                  self.y: T.cast(self.test_set_y, floatX)}
         self.test_error = theano.function([], self.cost, givens=givens)
 
-    def gradient_updates_momentum(self, params):
-        """Return the updates necessary to implement momentum"""
-        updates = []
-        for param in params:
-            # Update parameter
-            param_update = theano.shared(param.get_value()*0.,
-                                         broadcastable=param.broadcastable)
-            updates.append((param, param - self.learning_rate*param_update))
+    def export_numpy(self):
+        """Return the learned parameters of each layer as a list of tuples
+        (W, b, filter_shape, poolsize, activ) of NumPy arrays and names, with
+        filter_shape and poolsize None for fully connected layers"""
+        exported = []
+        for layer in self.layers:
+            # Recurrent layers are not supported
+            if isinstance(layer, RecurrentLayer):
+                raise TypeError("Unsupported layer")
             
-            # Store gradient with exponential decay
-            grad = T.grad(self.cost, param)
-            updates.append((param_update,
-                            self.momentum*param_update +
-                            (1 - self.momentum)*grad))
+            # Store weights, biases, and name of activation function
+            W = layer.W.get_value(borrow=True)
+            b = layer.b.get_value(borrow=True)
+            activ = layer.activ_fn.__name__ if layer.activ_fn else None
+            
+            # Store filter shape and poolsize of convolutional layers
+            if isinstance(layer, ConvPoolLayer):
+                exported.append((W, b, layer.filter_shape, layer.poolsize,
+                                 activ))
+            else:
+                exported.append((W, b, None, None, activ))
+        return exported
+
+    def gradient_updates_momentum(self, params, param_update, cost=None):
+        """Return the updates necessary to implement momentum with the flat
+        velocity vector param_update of all params, minimizing cost (defaults
+        to the network's cost)"""
+        # If no cost given, use network's cost
+        if cost is None:
+            cost = self.cost
+        
+        # Compute gradients of all parameters in a single backward pass
+        grads = T.grad(cost, params)
+        
+        # Velocity must hold exactly one element per parameter element
+        shapes = [param.get_value(borrow=True).shape for param in params]
+        sizes = [int(np.prod(shape)) for shape in shapes]
+        assert sum(sizes) == param_update.get_value(borrow=True).size
+        
+        # Store flattened gradient with exponential decay in one operation
+        grad = T.concatenate([grad.flatten() for grad in grads])
+        new_update = (self.momentum*param_update +
+                      (1 - self.momentum)*grad)
+        updates = [(param_update, new_update)]
+        
+        # Update each parameter with its slice of the new velocity
+        offset = 0
+        for param, shape, size in zip(params, shapes, sizes):
+            step = new_update[offset:offset+size].reshape(shape)
+            updates.append((param, param - self.learning_rate*step))
+            offset += size
             
         # Return the updates
         return updates
 
     @staticmethod
-    def load_data(filename):
-        """Load the datasets from file with filename"""
-        # Unpickle raw datasets from file as numpy arrays
-        with gzip.open(filename, 'rb') as file:
-            train_set, valid_set, test_set = cPickle.load(file)
+    def load_data(filename, dtype=theano.config.floatX):
+        """Load the datasets from file with filename, storing them as dtype.
+        The file is either a gzipped pickle or an uncompressed NumPy archive
+        (.npz) as written by dataset_gen.py"""
+        # Read raw datasets from NumPy archive, skipping decompression
+        if filename.endswith(".npz"):
+            with np.load(filename) as data:
+                train_set = (data["train_x"], data["train_y"])
+                valid_set = (data["valid_x"], data["valid_y"])
+                test_set = (data["test_x"], data["test_y"])
+        
+        # Otherwise unpickle raw datasets from file as numpy arrays
+        else:
+            with gzip.open(filename, 'rb') as file:
+                train_set, valid_set, test_set = cPickle.load(file)
     
         def shared_dataset(data_xy, borrow=True):
             """Load the dataset data_xy into shared variables"""
             # Split into input and output
             data_x, data_y = data_xy
             
-            # Store as numpy arrays with Theano data types
-            shared_x_array = np.asarray(data_x, dtype=theano.config.floatX)
-            shared_y_array = np.asarray(data_y, dtype=theano.config.floatX)
+            # Store as numpy arrays with the requested data type
+            shared_x_array = np.asarray(data_x, dtype=dtype)
+            shared_y_array = np.asarray(data_y, dtype=dtype)
             
             # Create Theano shared variables
             shared_x = theano.shared(shared_x_array, borrow=borrow)
@@ -254,6 +362,11 @@ class NNet1D(object):
         with gzip.open(filename, "rb") as file:
             return cPickle.load(file)
 
+    def output_numpy(self, x):
+        """Return the output of the network for input x, computed in NumPy
+        without going through Theano"""
+        return nnet_fast.forward(self.export_numpy(), x)
+
     def plot_test_predictions(self, display_figs=True, save_figs=False,
                               output_folder="images", output_format="png"):
         """Plots the predictions for the first batch of the test set"""
@@ -328,22 +441,40 @@ class NNet1D(object):
         return theano.printing.pydotprint(self.output, format=format,
                                           outfile=outfile)
 
+    def record_errors(self):
+        """Count a finished training step, then record and return the average
+        training and validation error"""
+        self.epochs += 1
+        mean_train_error = self.train_error()
+        mean_valid_error = self.valid_error()
+        self.train_errors.append(mean_train_error)
+        self.valid_errors.append(mean_valid_error)
+        return mean_train_error, mean_valid_error
+
     def save_model(self, filename):
         """Save the model to a file"""
         with gzip.open(filename, "wb") as file:
             file.write(cPickle.dumps(self))
 
+    def set_learning_rate(self, learning_rate):
+        """Set the learning rate used by the training functions"""
+        self.learning_rate.set_value(np.float32(learning_rate))
+
+    def set_momentum(self, momentum):
+        """Set the momentum used by the training functions"""
+        self.momentum.set_value(np.float32(momentum))
+
+    def shuffle_train_set(self):
+        """Shuffle the order in which training samples are batched"""
+        n_train = self.idx.get_value(borrow=True).shape[0]
+        self.idx.set_value(self.rng.permutation(n_train).astype("int32"))
+
     def train(self):
         """Apply one training step of the network and return average training
         and validation error"""
-        self.epochs += 1
-        for i in xrange(self.n_train_batches):
-            self.train_batch(i)
-        mean_train_error = self.train_error()
-        mean_valid_error = self.valid_error()
-        self.train_errors.append(mean_train_error)
-        self.valid_errors.append(mean_valid_error)
-        return mean_train_error, mean_valid_error
+        self.shuffle_train_set()
+        self.train_epoch()
+        return self.record_errors()
 
     def train_early_stopping(self, patience=15, improve_thresh=0.00001,
                              min_epochs=0, max_epochs=99999, print_error=True):
@@ -387,3 +518,68 @@ class NNet1D(object):
             
         # Return time elapsed
         return end_time - start_time
+
+    def train_hogwild(self, workers=None):
+        """Apply one training step of the network on the CPU, splitting the
+        batches between worker processes that update shared parameters
+        without locking (Hogwild), and return average training and validation
+        error. Uses one worker per CPU if workers is None"""
+        # Shared variables on the GPU cannot be shared between processes
+        if theano.config.device.startswith(("gpu", "cuda")):
+            raise RuntimeError("Hogwild training requires device=cpu")
+        
+        # Use one worker per CPU by default
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        
+        # Shuffle the training samples
+        self.shuffle_train_set()
+        
+        # Copy parameters into one flat block of memory shared by all workers
+        params = [param for layer in self.layers for param in layer.params]
+        values = [param.get_value(borrow=True) for param in params]
+        size = sum(value.size for value in values)
+        flat_params = np.frombuffer(RawArray("f", size), dtype=np.float32)
+        views = []
+        offset = 0
+        for value in values:
+            view = flat_params[offset:offset+value.size].reshape(value.shape)
+            view[...] = value
+            views.append(view)
+            offset += value.size
+        
+        def work(batches):
+            """Train on batches, adding each change of the parameters to the
+            shared parameters without locking"""
+            for i in batches:
+                # Start from the current shared parameters
+                starts = [view.copy() for view in views]
+                for param, start in zip(params, starts):
+                    param.set_value(start)
+                
+                # Train on batch and add the change to the shared parameters
+                self.train_batch(i)
+                for param, start, view in zip(params, starts, views):
+                    view += param.get_value(borrow=True) - start
+        
+        # Train each worker process on every workers-th batch
+        processes = []
+        for k in xrange(workers):
+            batches = xrange(k, self.n_train_batches, workers)
+            processes.append(multiprocessing.Process(target=work,
+                                                     args=(batches,)))
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        
+        # Raise error if any worker failed
+        for process in processes:
+            if process.exitcode != 0:
+                raise RuntimeError("Hogwild worker exited with code %s" %
+                                   process.exitcode)
+        
+        # Store the trained shared parameters and record errors
+        for param, view in zip(params, views):
+            param.set_value(view.copy())
+        return self.record_errors()
@@ -0,0 +1,93 @@
+"""Forward pass of a trained 1D neural network in NumPy, bypassing Theano for
+fast prediction on the CPU"""
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+# Bytes of input windows to convolve at once, sized to stay in the L2 cache
+block_bytes = 256 * 1024
+
+
+def relu(x):
+    """Rectified linear units activation function implemented in NumPy"""
+    return np.maximum(x, 0)
+
+
+def tanh(x):
+    """Hyperbolic tangent activation function implemented in NumPy"""
+    return np.tanh(x)
+
+
+def sigmoid(x):
+    """Sigmoid activation function implemented in NumPy"""
+    return 1 / (1 + np.exp(-x))
+
+
+# Activation functions by the name of their Theano counterpart
+activ_fns = {"relu": relu, "tanh": tanh, "sigmoid": sigmoid}
+
+
+def activate(x, activ):
+    """Apply the activation function named activ (None for identity)"""
+    if activ is None:
+        return x
+    return activ_fns[activ](x)
+
+
+def conv_pool(x, W, b, poolsize, activ):
+    """Convolve the feature maps x (batch, channels, length) with the filters
+    W (filters, channels, 1, filter_length), maxpool and activate"""
+    # View every window of the input without copying
+    batch, channels, length = x.shape
+    filters, filter_length = W.shape[0], W.shape[3]
+    conv_length = length - filter_length + 1
+    shape = (batch, channels, filter_length, conv_length)
+    strides = x.strides + (x.strides[2],)
+    windows = as_strided(x, shape=shape, strides=strides)
+
+    # Flip filters to match Theano's convolution
+    kernels = np.ascontiguousarray(W[:, :, 0, ::-1])
+
+    # Split the output length into blocks, a multiple of poolsize long, whose
+    # windows fit in cache so each block is reused by all filters
+    window_bytes = batch * channels * filter_length * x.itemsize
+    block_length = max(block_bytes / window_bytes / poolsize, 1) * poolsize
+    pooled_shape = (batch, filters, conv_length / poolsize)
+    pooled_out = np.empty(pooled_shape, dtype=np.result_type(x, W))
+    for start in xrange(0, conv_length, block_length):
+        # Apply all filters to the block as one product
+        stop = min(start + block_length, conv_length)
+        block = windows[:, :, :, start:stop]
+        conv_out = np.tensordot(block, kernels, axes=([1, 2], [1, 2]))
+
+        # Downsample each feature map individually, using maxpooling
+        new_shape = (batch, (stop - start) / poolsize, poolsize, filters)
+        pooled = conv_out.reshape(new_shape).max(axis=2).transpose(0, 2, 1)
+        pooled_out[:, :, start/poolsize:stop/poolsize] = pooled
+
+    # Add biases and activate
+    return activate(pooled_out + b[np.newaxis, :, np.newaxis], activ)
+
+
+def fully_connected(x, W, b, activ):
+    """Apply a fully connected layer with weights W and biases b to x"""
+    return activate(np.dot(x, W) + b, activ)
+
+
+def forward(layers, x):
+    """Return the output of the network given by layers, as exported by
+    NNet1D.export_numpy, for the input matrix x"""
+    x = np.ascontiguousarray(x, dtype=np.float32)
+    batch = x.shape[0]
+    for W, b, filter_shape, poolsize, activ in layers:
+        # Convolutional layers take (batch, channels, length) feature maps
+        if filter_shape is not None:
+            if x.ndim == 2:
+                x = x.reshape(batch, 1, -1)
+            x = conv_pool(x, W, b, poolsize, activ)
+
+        # Fully connected layers take flattened inputs
+        else:
+            x = fully_connected(x.reshape(batch, -1), W, b, activ)
+    return x
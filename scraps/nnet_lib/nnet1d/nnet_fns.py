@@ -5,7 +5,7 @@ import theano.tensor as T
 
 def relu(x):
     """Rectified linear units activation function implemented using Theano"""
-    return T.switch(x < 0, 0, x)
+    return T.nnet.relu(x)
 
 
 def tanh(x):
@@ -20,10 +20,12 @@ def sigmoid(x):
 
 def sqr_error_cost(y, output):
     """Return the average square error between output vector and y in Theano"""
-    return T.mean(T.sqr(y - output))
+    diff = y - output
+    return T.mean(diff * diff)
 
 
 def abs_error_cost(y, output):
     """Return the average absolute error between output vector and y in
     Theano"""
-    return T.mean(T.abs_(y - output))
\ No newline at end of file
+    diff = y - output
+    return T.mean(abs(diff))
\ No newline at end of file